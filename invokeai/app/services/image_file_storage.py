@@ -11,6 +11,10 @@ from send2trash import send2trash
 
 from invokeai.app.util.thumbnails import get_thumbnail_name, make_thumbnail
 
+# PIL's default zlib level for PNGs, and a much faster one for images that are only passed between nodes
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+INTERMEDIATE_PNG_COMPRESS_LEVEL = 1
+
 
 # TODO: Should these excpetions subclass existing python exceptions?
 class ImageFileNotFoundException(Exception):
@@ -62,6 +66,7 @@ class ImageFileStorageBase(ABC):
         metadata: Optional[dict] = None,
         graph: Optional[dict] = None,
         thumbnail_size: int = 256,
+        compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
     ) -> None:
         """Saves an image and a 256x256 WEBP thumbnail. Returns a tuple of the image name, thumbnail name, and created timestamp."""
         pass
@@ -112,6 +117,7 @@ class DiskImageFileStorage(ImageFileStorageBase):
         metadata: Optional[dict] = None,
         graph: Optional[dict] = None,
         thumbnail_size: int = 256,
+        compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
     ) -> None:
         try:
             self.__validate_storage_folders()
@@ -124,7 +130,7 @@ class DiskImageFileStorage(ImageFileStorageBase):
             if graph is not None:
                 pnginfo.add_text("invokeai_graph", json.dumps(graph))
 
-            image.save(image_path, "PNG", pnginfo=pnginfo)
+            image.save(image_path, "PNG", pnginfo=pnginfo, compress_level=compress_level)
             thumbnail_name = get_thumbnail_name(image_name)
             thumbnail_path = self.get_path(thumbnail_name, thumbnail=True)
             thumbnail_image = make_thumbnail(image, thumbnail_size)
@@ -14,6 +14,8 @@ from invokeai.app.models.image import (
 )
 from invokeai.app.services.board_image_record_storage import BoardImageRecordStorageBase
 from invokeai.app.services.image_file_storage import (
+    DEFAULT_PNG_COMPRESS_LEVEL,
+    INTERMEDIATE_PNG_COMPRESS_LEVEL,
     ImageFileDeleteException,
     ImageFileNotFoundException,
     ImageFileSaveException,
@@ -218,7 +220,15 @@ class ImageService(ImageServiceABC):
             )
             if board_id is not None:
                 self._services.board_image_records.add_image_to_board(board_id=board_id, image_name=image_name)
-            self._services.image_files.save(image_name=image_name, image=image, metadata=metadata, graph=graph)
+            # Intermediates are rarely looked at again and the next node usually reads them back from the in-memory
+            # cache, so compress them as cheaply as possible
+            self._services.image_files.save(
+                image_name=image_name,
+                image=image,
+                metadata=metadata,
+                graph=graph,
+                compress_level=INTERMEDIATE_PNG_COMPRESS_LEVEL if is_intermediate else DEFAULT_PNG_COMPRESS_LEVEL,
+            )
             image_dto = self.get_dto(image_name)
 
             return image_dto
@@ -18,7 +18,10 @@ class DefaultInvocationProcessor(InvocationProcessorABC):
     __threadLimit: BoundedSemaphore
 
     def start(self, invoker) -> None:
-        # if we do want multithreading at some point, we could make this configurable
+        # Invocations already run on this dedicated thread rather than on the API server's event loop, so a long
+        # PIL/numpy/torch operation never blocks request handling.
+        # if we do want multithreading at some point, we could make this configurable - but note that the model
+        # manager and its cache are not thread-safe, so only invocations that don't load models could run concurrently
         self.__threadLimit = BoundedSemaphore(1)
         self.__invoker = invoker
         self.__stop_event = Event()